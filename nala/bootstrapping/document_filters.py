@@ -1,26 +1,296 @@
 import abc
-from copy import deepcopy
+import hashlib
+import multiprocessing
+import os
+from copy import copy
+from functools import partial
+from itertools import islice
 import json
 import csv
 import re
+import sys
 import time
 import pkg_resources
 from nalaf.learning.crfsuite import PyCRFSuite
 from nalaf.preprocessing.labelers import BIEOLabeler
 from nala.learning.postprocessing import PostProcessing
-from nalaf import print_verbose, print_debug
-from nala.preprocessing.definers import InclusiveNLDefiner
+from nalaf import print_verbose, print_debug, is_verbose_mode, is_debug_mode
 from nala.preprocessing.definers import ExclusiveNLDefiner
 from nalaf.preprocessing.spliters import NLTKSplitter
 from nalaf.structures.data import Dataset
 from nalaf.utils.cache import Cacheable
-from collections import Counter
+from collections import Counter, OrderedDict
 
 from nala.utils import MUT_CLASS_ID
 from nala.utils import get_prepare_pipeline_for_best_model
 
 from nala.utils.pattern_eval import highlighted_text
 
+try:
+    import re2 as _fast_re
+except ImportError:
+    try:
+        import regex as _fast_re
+    except ImportError:
+        _fast_re = re
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+_PUNCT_TABLE = str.maketrans(dict.fromkeys('./-(){}[],%', ' '))
+""" punctuation that gets replaced by spaces before matching the nl patterns """
+
+PROFILE = False
+""" time the regex scan of HighRecallRegexDocumentFilter (costs two clock reads per match) """
+
+_SENT_SEP = '\x00'
+""" separates the sentences of a document when they get searched together, is neither a word nor a space character """
+
+_HIGHLIGHT_MATCHES = is_verbose_mode and sys.stdout.isatty()
+""" print each regex match highlighted within its sentence, only worth it for verbose runs on a terminal """
+
+
+def _compile_pattern(pattern):
+    """
+    Compiles a high recall pattern with the fastest available engine (re2 if installed, else regex, else re).
+    Patterns that use syntax the engine does not support (e.g. backreferences under re2) fall back to re.
+    """
+    try:
+        return _fast_re.compile(pattern)
+    except _fast_re.error:
+        return re.compile(pattern)
+
+
+def _parse(pattern):
+    """ :returns the compiled pattern parsed by sre_parse or None if its syntax is specific to another engine """
+    try:
+        return sre_parse.parse(pattern.pattern)
+    except re.error:
+        return None
+
+
+def _walk(parsed):
+    """ :returns iterator of all (op, av) of the parsed pattern, including the ones nested in groups, branches, etc. """
+    for op, av in parsed:
+        yield op, av
+        for item in av if isinstance(av, (tuple, list)) else ():
+            for sub in item if isinstance(item, list) else (item,):
+                if isinstance(sub, sre_parse.SubPattern):
+                    yield from _walk(sub)
+
+
+def _fusable(pattern):
+    """
+    :returns whether the pattern keeps its meaning as an alternative of the union:
+    numbered group references would point at the wrong group once the alternatives are wrapped in groups
+    and global flags (e.g. (?i)) are only allowed at the start of the whole expression
+    """
+    parsed = _parse(pattern)
+    if parsed is None:
+        return False
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & ~sre_constants.SRE_FLAG_UNICODE:
+        return False
+    return not any(op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS) for op, _ in _walk(parsed))
+
+
+def _window_safe(pattern):
+    """
+    :returns whether the pattern matches the same within a pos/endpos window of a larger text as in a string of its own,
+    which does not hold for ^, $, \\A, \\Z (they refer to the whole text) and lookbehinds (they see before pos)
+    """
+    parsed = _parse(pattern)
+    if parsed is None:
+        return False
+    anchors = (sre_constants.AT_BEGINNING, sre_constants.AT_BEGINNING_STRING,
+               sre_constants.AT_END, sre_constants.AT_END_STRING)
+    for op, av in _walk(parsed):
+        if op is sre_constants.AT and av in anchors:
+            return False
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT) and av[0] < 0:
+            return False
+    return True
+
+
+def _compile_union(patterns):
+    """
+    Fuses the compiled patterns into a single alternation so that a text gets scanned once instead of once per pattern.
+    Each alternative is wrapped in the named group p[index], thus match.lastgroup tells which pattern matched.
+
+    :returns the union or None if there are no patterns or they cannot be fused (they then get searched one by one)
+    """
+    if not patterns or not all(_fusable(p) for p in patterns):
+        return None
+    try:
+        return _compile_pattern('|'.join('(?P<p{}>{})'.format(i, p.pattern) for i, p in enumerate(patterns)))
+    except re.error:
+        return None
+
+
+def _required_literals(parsed):
+    """
+    :returns set of literals of which at least one is contained in any text matched by the parsed (sre_parse) pattern
+    or None if no such literal can be told
+    """
+    candidates = []
+    run = ''
+
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            run += chr(av)
+            continue
+
+        if run:
+            candidates.append({run})
+            run = ''
+
+        required = None
+        if op is sre_constants.SUBPATTERN:
+            required = _required_literals(av[-1])
+        elif op is sre_constants.BRANCH:
+            alternatives = [_required_literals(x) for x in av[1]]
+            if all(alternatives):
+                required = set().union(*alternatives)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            required = _required_literals(av[2])
+
+        if required:
+            candidates.append(required)
+
+    if run:
+        candidates.append({run})
+
+    # the most selective candidate is the one with the longest shortest literal
+    return max(candidates, key=lambda x: min(len(literal) for literal in x)) if candidates else None
+
+
+def _compile_prefilter(patterns):
+    """
+    :returns case insensitive alternation of literals so that a text not matching it cannot match any of the patterns
+    or None if there are no patterns or any of them has no required literal
+    """
+    if not patterns:
+        return None
+
+    literals = set()
+    for pattern in patterns:
+        parsed = _parse(pattern)
+        required = _required_literals(parsed) if parsed is not None else None
+        if not required:
+            return None
+        literals |= required
+
+    # a literal containing another one is redundant
+    literals = [literal for literal in literals if not any(x != literal and x in literal for x in literals)]
+    return re.compile('|'.join(re.escape(literal) for literal in sorted(literals)), re.IGNORECASE)
+
+
+def _as_bytes(pattern, compile=_compile_pattern):
+    """
+    :returns the pattern compiled anew for ascii encoded bytes, which get scanned faster than str,
+    or None if the pattern itself is not ascii
+    """
+    try:
+        return compile(pattern.pattern.encode('ascii'))
+    except UnicodeEncodeError:
+        return None
+
+
+def _document_cache_key(pmid, doc, binary_model, *params):
+    """
+    :returns hash of the document text together with the binary model (path and modification time)
+    and any further filter parameters the decision of the filter depends on,
+    binary_model is None if the decision does not depend on any model
+    """
+    model_stamp = os.path.getmtime(binary_model) if binary_model and os.path.exists(binary_model) else None
+    key = '|'.join(str(x) for x in (pmid, binary_model, model_stamp) + params + (doc.get_text(),))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _prediction_dataset(pmid, doc):
+    """
+    :returns Dataset containing a shallow copy of doc, whose parts have their own sentences and their own copies
+    of the annotations and predicted annotations (which ExclusiveNLDefiner changes the subclass of)
+    so that preparing, tagging and defining the dataset leaves doc untouched without deep copying all of it
+    """
+    doc_copy = copy(doc)
+    doc_copy.parts = OrderedDict()
+    for part_id, part in doc.parts.items():
+        part_copy = copy(part)
+        part_copy.sentences_ = list(part.sentences_)
+        part_copy.sentences = list(part.sentences)
+        part_copy.annotations = [copy(ann) for ann in part.annotations]
+        part_copy.predicted_annotations = [copy(ann) for ann in part.predicted_annotations]
+        doc_copy.parts[part_id] = part_copy
+
+    dataset = Dataset()
+    dataset.documents[pmid] = doc_copy
+    return dataset
+
+
+_worker_function = None
+""" function that a worker process of _map_documents applies to the documents it gets """
+
+
+def _init_worker(function):
+    global _worker_function
+    _worker_function = function
+
+
+def _apply_worker_function(document):
+    return _worker_function(*document)
+
+
+def _map_documents(function, documents, n_jobs=1, chunksize=8):
+    """
+    Lazily applies function(pmid, doc) to each of the documents and yields (pmid, doc, result) in the same order.
+
+    With n_jobs > 1 the documents get processed by a pool of worker processes in batches of n_jobs * chunksize,
+    so that no more than one batch is read ahead from documents (which usually get downloaded on the fly).
+    The function is handed to the workers once when they start; with the fork start method (default on Linux)
+    only the documents and results get pickled.
+    """
+    if n_jobs <= 1:
+        for pmid, doc in documents:
+            yield pmid, doc, function(pmid, doc)
+        return
+
+    documents = iter(documents)
+    with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=(function,)) as pool:
+        while True:
+            batch = list(islice(documents, n_jobs * chunksize))
+            if not batch:
+                break
+            for (pmid, doc), result in zip(batch, pool.map(_apply_worker_function, batch, chunksize)):
+                yield pmid, doc, result
+
+
+def _matched_pattern(patterns, match):
+    """ :returns the compiled pattern out of patterns whose alternative in the union produced match """
+    return patterns[int(match.lastgroup[1:])]
+
+
+def _search_each(patterns, text):
+    """ :returns the first match of the first of the patterns that matches text or None """
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match
+    return None
+
+
+def _finditer(patterns, union, text, pos, endpos):
+    """
+    :returns iterator of (pattern, match) for all matches of the patterns within text[pos:endpos],
+    found with a single scan of the union or pattern by pattern if there is no union
+    """
+    if union is None:
+        return ((p, match) for p in patterns for match in p.finditer(text, pos, endpos))
+    return ((_matched_pattern(patterns, match), match) for match in union.finditer(text, pos, endpos))
+
 
 class DocumentFilter:
     """
@@ -63,7 +333,8 @@ class KeywordsDocumentFilter(DocumentFilter):
         self.keywords = keywords
         """the keywords which the document should contain"""
 
-        self.keywords = (re.compile(keyword, re.IGNORECASE) for keyword in keywords)
+        self.union = re.compile('|'.join('(?:{})'.format(keyword) for keyword in keywords), re.IGNORECASE)
+        """all keywords fused into one alternation"""
 
     def filter(self, documents):
         """
@@ -72,8 +343,7 @@ class KeywordsDocumentFilter(DocumentFilter):
         for pmid, doc in documents:
             # if any part of the document contains any of the keywords
             # yield that document
-            if any(any(keyword.search(part.text) for keyword in self.keywords)
-                   for part in doc.parts.values()):
+            if any(self.union.search(part.text) for part in doc.parts.values()):
                 yield pmid, doc
 
 
@@ -147,71 +417,132 @@ class ManualStatsDocumentFilter(DocumentFilter, Cacheable):
                 yield docid, doc
 
 
-class QuickNalaFilter(DocumentFilter):
-    def __init__(self, binary_model="nala/data/default_model", threshold=1, labeler=BIEOLabeler()):
+class QuickNalaFilter(DocumentFilter, Cacheable):
+    """
+    Keeps documents in which nala predicts natural language mentions.
+    The found mentions are cached per document text and binary model.
+
+    Kept documents are yielded tagged, i.e. with the predicted annotations of nala. Documents that were decided
+    by a worker process or from the cache get tagged again in this process when they are kept.
+    """
+    def __init__(self, binary_model="nala/data/default_model", threshold=1, labeler=BIEOLabeler(), n_jobs=1):
+        super().__init__()
         self.binary_model = binary_model
         """ location where binary model for nala (crfsuite) is saved """
         self.threshold = threshold
         """threshold for nala to include documents that contain overlapping annotations with confidence lower than set threshold"""
-        self.pipeline = get_prepare_pipeline_for_best_model()
-        """best features and hyperparameters"""
+        self._pipeline = None
         self.labeler = labeler
         """used labeler"""
+        self.n_jobs = n_jobs
+        """ number of processes to tag the documents with, 1 tags them in this process """
+        self._crf = None
 
     def filter(self, documents):
-        pycrf = PyCRFSuite(self.binary_model)
-        for pmid, doc in documents:
-            dataset = Dataset()
-            dataset.documents[pmid] = doc
-            self.pipeline.execute(dataset)
-            self.labeler.label(dataset)
-            pycrf.tag(dataset, MUT_CLASS_ID)
-            PostProcessing().process(dataset)
-            ExclusiveNLDefiner().define(dataset)
-            total_nl_mentions = []
-            for part in doc:
-                # print(part.annotations)
-                print_verbose('predicted_annotations:', part.predicted_annotations)
-                nl_mentions = [(ann.text, ann.subclass, ann.confidence) for ann in part.predicted_annotations if ann.subclass != 0 and ann.confidence <= self.threshold]
-                total_nl_mentions += nl_mentions
+        for pmid, doc, (key, total_nl_mentions, tagged) in _map_documents(self._nl_mentions, documents, self.n_jobs):
+            self.cache[key] = total_nl_mentions
             if any(total_nl_mentions):
-                print('nl mentions', json.dumps(total_nl_mentions, indent=4))
+                if not tagged or self.n_jobs > 1:
+                    # the tagging happened on a copy of doc in a worker or not at all
+                    self._tag(pmid, doc)
+                if is_verbose_mode:
+                    print_verbose('nl mentions', json.dumps(total_nl_mentions, separators=(',', ':')))
                 yield pmid, doc
-            print_verbose('nothing found')
+            else:
+                print_verbose('nothing found')
+
+    def _nl_mentions(self, pmid, doc):
+        """
+        Tags a single document with nala.
+        Can run in a worker process, thus leaves self.cache untouched.
+
+        :returns (cache key, list of (text, subclass, confidence) of the predicted nl mentions, whether doc got tagged)
+        """
+        key = _document_cache_key(pmid, doc, self.binary_model, self.threshold)
+        if key in self.cache:
+            return key, self.cache[key], False
+
+        self._tag(pmid, doc)
+        total_nl_mentions = []
+        for part in doc:
+            # print(part.annotations)
+            print_verbose('predicted_annotations:', part.predicted_annotations)
+            nl_mentions = [(ann.text, ann.subclass, ann.confidence) for ann in part.predicted_annotations if ann.subclass != 0 and ann.confidence <= self.threshold]
+            total_nl_mentions += nl_mentions
+        return key, total_nl_mentions, True
+
+    def _tag(self, pmid, doc):
+        """ adds the nl mentions predicted by nala to the predicted annotations of doc """
+        dataset = Dataset()
+        dataset.documents[pmid] = doc
+        self.pipeline.execute(dataset)
+        self.labeler.label(dataset)
+        self.crf.tag(dataset, MUT_CLASS_ID)
+        PostProcessing().process(dataset)
+        ExclusiveNLDefiner().define(dataset)
+
+    @property
+    def pipeline(self):
+        """ best features and hyperparameters, built on first use in each process """
+        if self._pipeline is None:
+            self._pipeline = get_prepare_pipeline_for_best_model()
+        return self._pipeline
+
+    @property
+    def crf(self):
+        """ nala tagger, opened on first use in each process """
+        if self._crf is None:
+            self._crf = PyCRFSuite(self.binary_model)
+        return self._crf
 
 
 class HighRecallRegexClassifier():
 
+    _PATTERN_CACHE = {}
+    """ (patterns, union) per (ST, NL), shared by all instances so files are read and compiled only once """
+
     def __init__(self, ST=True, NL=True):
         assert(ST or NL)
 
-        self.patterns = []
+        key = (ST, NL)
+        if key not in HighRecallRegexClassifier._PATTERN_CACHE:
+            patterns = HighRecallRegexClassifier._read_patterns(ST, NL)
+            HighRecallRegexClassifier._PATTERN_CACHE[key] = (patterns, _compile_union(patterns))
+
+        self.patterns, self.union = HighRecallRegexClassifier._PATTERN_CACHE[key]
+        """ compiled patterns and all patterns fused into one alternation (None if they cannot be fused) """
+        self._search = self.union.search if self.union is not None else partial(_search_each, self.patterns)
+
+    @staticmethod
+    def _read_patterns(ST, NL):
+        regexs = []
 
         if ST:
             regex_st_file = pkg_resources.resource_filename('nala.data', 'regex_st.json')
             with open(regex_st_file, 'r') as f:
-                conventions = json.loads(f.read())
-                self.patterns += [re.compile(x) for x in conventions]
+                regexs += json.loads(f.read())
 
             tmvarregex_file = pkg_resources.resource_filename('nala.data', 'RegEx.NL')
             with open(tmvarregex_file) as file:
                 raw_regexps = list(csv.reader(file, delimiter='\t'))
-                regexps = [x[0] for x in raw_regexps if len(x[0]) < 265]
-                self.patterns = [re.compile(x) for x in regexps]
+                regexs += [x[0] for x in raw_regexps if len(x[0]) < 265]
 
         if NL:
             pattern_file_name = pkg_resources.resource_filename('nala.data', 'nl_patterns.json')
 
             with open(pattern_file_name, 'r') as f:
-                regexs = json.load(f)
-                self.patterns += [re.compile(x) for x in regexs]
+                regexs += json.load(f)
 
+        # the same regex may be listed in more than one file, keep only its first occurrence
+        unique_regexs = list(OrderedDict.fromkeys(regexs))
+
+        return [_compile_pattern(x) for x in unique_regexs]
 
     def __call__(self, text):
-        return any(p.search(text) for p in self.patterns)
+        return self._search(text) is not None
 
 
-class HighRecallRegexDocumentFilter(DocumentFilter):
+class HighRecallRegexDocumentFilter(DocumentFilter, Cacheable):
     """
     Filter that uses regular expression to first get possible natural language mentions in sentences.
     Then each possible nl mention gets compared to tmVar results and Nala predictions. If there is no overlap,
@@ -222,10 +553,17 @@ class HighRecallRegexDocumentFilter(DocumentFilter):
     Not any(sentence that contains valid nl mention according to this definition)
 
     tmVar will be used in early stages and discarded as soon as there are no more results, thus gets a parameter.
+
+    Whether a document was kept is cached per document text, pattern file, binary model (if use_nala) and filter parameters.
     """
 
+    _PATTERN_CACHE = {}
+    """ (patterns, union, prefilter, ...) per pattern file and its modification time,
+    shared by all instances so files are read and compiled only once (and again once they change) """
+
     def __init__(self, binary_model="nala/data/default_model", override_cache=False, expected_max_results=10,
-                 pattern_file_name=None, threshold=1, min_found=1, use_nala=False, labeler=BIEOLabeler()):
+                 pattern_file_name=None, threshold=1, min_found=1, use_nala=False, labeler=BIEOLabeler(), n_jobs=1):
+        super().__init__()
         self.location_binary_model = binary_model
         """ location where binary model for nala (crfsuite) is saved """
         self.override_cache=override_cache
@@ -235,25 +573,45 @@ class HighRecallRegexDocumentFilter(DocumentFilter):
         """ :returns maximum of [x] documents (can be less if not found) """
         self.threshold=threshold
         """threshold for nala to include documents that contain overlapping annotations with confidence lower than set threshold"""
-        self.pipeline=get_prepare_pipeline_for_best_model()
-        """ best setting (features, etc.) for tagging """
+        self._pipeline = None
         self.min_found = min_found
         """ minimum found """
         self.use_nala = use_nala
         """ if use nala predictions """
         self.labeler = labeler
         """ the used labeler """
+        self.n_jobs = n_jobs
+        """ number of processes to filter the documents with, 1 filters them in this process """
+        self._crf = None
 
         # read in nl_patterns
         if not pattern_file_name:
             pattern_file_name = pkg_resources.resource_filename('nala.data', 'nl_patterns.json')
             # todo make {AA} substitutions in code to make regular expressions more readable
+        self.pattern_file_name = pattern_file_name
+        """ json file containing the regexs """
+        self.pattern_file_stamp = os.path.getmtime(pattern_file_name)
+        """ modification time of the pattern file when its patterns were read, part of the cache keys """
 
-        with open(pattern_file_name, 'r') as f:
-            regexs = json.load(f)
-            self.patterns = [re.compile(x) for x in regexs]
-            """ compiled regex patterns from pattern_file param to specify custom json file,
-             containing regexs for high recall finding of nl mentions. (or sth else) """
+        patterns_key = (pattern_file_name, self.pattern_file_stamp)
+        if patterns_key not in HighRecallRegexDocumentFilter._PATTERN_CACHE:
+            with open(pattern_file_name, 'r') as f:
+                patterns = [_compile_pattern(x) for x in json.load(f)]
+            union = _compile_union(patterns)
+            prefilter = _compile_prefilter(patterns)
+            union_bytes = _as_bytes(union) if union is not None else None
+            prefilter_bytes = _as_bytes(prefilter, partial(re.compile, flags=re.IGNORECASE)) if prefilter else None
+            HighRecallRegexDocumentFilter._PATTERN_CACHE[patterns_key] = \
+                (patterns, union, prefilter, union_bytes, prefilter_bytes, all(_window_safe(p) for p in patterns))
+
+        self.patterns, self.union, self.prefilter, self.union_bytes, self.prefilter_bytes, self.window_safe = \
+            HighRecallRegexDocumentFilter._PATTERN_CACHE[patterns_key]
+        """ compiled regex patterns from pattern_file param to specify custom json file,
+         containing regexs for high recall finding of nl mentions. (or sth else),
+         all patterns fused into one alternation to scan each sentence only once (None if they cannot be fused)
+         and the literals the patterns require to cheaply skip sentences (None if not every pattern has one),
+         the latter two also compiled for ascii bytes (None if the patterns are not ascii)
+         and whether the patterns can search a sentence within its bounds of the whole document text """
 
     def filter(self, documents, min_found=1, use_nala=False):
         """
@@ -264,177 +622,234 @@ class HighRecallRegexDocumentFilter(DocumentFilter):
         _start_time = time.time()
         _total_time = 0
 
-        _time_avg_per_pattern = 0
-        _pattern_calls = 0
-        _time_reg_pattern_total = 0
-        _time_max_pattern = 0
-        _low_performant_pattern = ""
-
-        # NLDefiners init
-        exclusive_definer = ExclusiveNLDefiner()
-        _e_array = [0, 0, 0]
-        inclusive_definer = InclusiveNLDefiner()
-        _i_array = [0, 0]
-
-        last_found = 0
-        crf = PyCRFSuite(self.location_binary_model)
+        self._pattern_calls = 0
+        self._time_reg_pattern_total = 0
 
-        # counter_to_stop_for_caching = 0
+        decide = partial(self._decide, min_found=min_found, use_nala=use_nala)
 
-        for pmid, doc in documents:
-            # if any part of the document contains any of the keywords
-            # yield that document
+        for pmid, doc, (key, keep) in _map_documents(decide, documents, self.n_jobs):
+            self.cache[key] = keep
 
-            # if counter_to_stop_for_caching > 400:
-            #     break
-            # counter_to_stop_for_caching += 1
-            # print(counter_to_stop_for_caching)
-
-            part_offset = 0
-            data_tmp = Dataset()
-            data_tmp.documents[pmid] = doc
-            data_nala = deepcopy(data_tmp)
-            NLTKSplitter().split(data_tmp)
-            # data_tmvar = TmVarTagger().generate_abstracts([pmid])
-            if use_nala:
-                self.pipeline.execute(data_nala)
-                self.labeler.label(data_nala)
-                crf.tag(data_nala, MUT_CLASS_ID)
-                PostProcessing().process(data_nala)
-                ExclusiveNLDefiner().define(data_nala)
-
-            used_regexs = {}
-
-            positive_sentences = 0
-            for i, x in enumerate(doc.parts):
-                # print("Part", i)
-                sent_offset = 0
-                cur_part = doc.parts.get(x)
-                sentences = cur_part.sentences_
-
-                for sent in sentences:
-                    sent_length = len(sent)
-                    new_text = sent.lower()
-                    new_text = re.sub('[\./\\-(){}\[\],%]', ' ', new_text)
-                    # new_text = re.sub('\W+', ' ', new_text)
-
-                    found_in_sentence = False
-
-                    for i, reg in enumerate(self.patterns):
-                        _lasttime = time.time()  # time start var
-                        match = reg.search(new_text)
-
-                        # debug bottleneck patterns
-                        _time_current_reg = time.time() - _lasttime  # time end var
-                        _pattern_calls += 1  # pattern calls already occured
-                        _time_reg_pattern_total += _time_current_reg  # total time spent on searching with patterns
-                        if _time_reg_pattern_total > 0:
-                            _time_avg_per_pattern = _time_reg_pattern_total / _pattern_calls  # avg spent time per pattern call
-                        # todo create pattern performance eval for descending amount of recognized patterns
-                        # if _pattern_calls > len(patterns) * 20 and _time_avg_per_pattern * 10000 < _time_current_reg:
-                        #     print("BAD_PATTERN_PERFORMANCE:", _time_avg_per_pattern, _time_current_reg, reg.pattern)
-                        # if _time_max_pattern < _time_current_reg:
-                        #     _time_max_pattern = _time_current_reg
-                        #     _low_performant_pattern = reg.pattern
-                        #     print(_time_avg_per_pattern, _low_performant_pattern, _time_max_pattern)
-
-                        # if reg.pattern == r'(\b\w*\d+\w*\b\s?){1,3} (\b\w+\b\s?){1,4} (\b\w*\d+\w*\b\s?){1,3} (\b\w+\b\s?){1,4} (deletion|deleting|deleted)':
-                        #     if _time_current_reg > _time_avg_per_pattern * 10:
-                        #         # print(_time_avg_per_pattern, _time_current_reg)
-                        #         f.write("BAD_PATTERN\n")
-                        #         f.write(sent + "\n")
-                        #         f.write(new_text + "\n")
-                        if match:
-                            # if pmid in data_tmvar.documents:
-                            #     anti_doc = data_tmvar.documents.get(pmid)
-                            nala_doc = data_nala.documents.get(pmid)
-
-                            start = part_offset + sent_offset + match.span()[0]
-                            end = part_offset + sent_offset + match.span()[1]
-                            # print("TmVar is not overlapping?:", not anti_doc.overlaps_with_mention(start, end))
-                            # print(not nala_doc.overlaps_with_mention(start, end, annotated=False))
-
-
-                            if reg.pattern in used_regexs:
-                                used_regexs[reg.pattern] += 1
-                            else:
-                                used_regexs[reg.pattern] = 1
-                            print(color.PURPLE + new_text.replace(match.group(),
-                                                                  color.BOLD + color.DARKCYAN + color.UNDERLINE + match.group() + color.END + color.PURPLE) + color.END)
-                            if not found_in_sentence:
-                                positive_sentences += 1
-                                found_in_sentence = True
-                                            # if not anti_doc.overlaps_with_mention(start,
-                                            #                                       end) \
-                                            #         and not nala_doc.overlaps_with_mention(start, end, annotated=False):
-                                            #     _e_result = exclusive_definer.define_string(
-                                            #         new_text[match.span()[0]:match.span()[1]])
-                                            #     _e_array[_e_result] += 1
-                                            #     _i_result = inclusive_definer.define_string(
-                                            #         new_text[match.span()[0]:match.span()[1]])
-                                            #     _i_array[_i_result] += 1
-                                            # todo write to file param + saving to manually annotate and find tp + fp for performance eval on each pattern
-                                            # print("e{}\ti{}\t{}\t{}\t{}\n".format(_e_result, _i_result, sent, match, reg.pattern))
-
-                                            # last_found += 1
-                                            # found_in_sentence = True
-                                # else:
-                                #     # if nala not used only tmvar considered
-                                #     if not anti_doc.overlaps_with_mention(start, end):
-                                #         _e_result = exclusive_definer.define_string(
-                                #             new_text[match.span()[0]:match.span()[1]])
-                                #         _e_array[_e_result] += 1
-                                #         _i_result = inclusive_definer.define_string(
-                                #             new_text[match.span()[0]:match.span()[1]])
-                                #         _i_array[_i_result] += 1
-                                #         # todo write to file param + saving to manually annotate and find tp + fp for performance eval on each pattern
-                                #         # print("e{}\ti{}\t{}\t{}\t{}\n".format(_e_result, _i_result, sent, match, reg.pattern))
-                                #         last_found += 1
-                                #         found_in_sentence = True
-
-                            if use_nala:
-                                nala_found_mention = nala_doc.overlaps_with_mention(start, end, annotated=False)
-                                if nala_found_mention:
-                                    print_verbose(nala_found_mention)
-                                    if nala_found_mention.subclass > 0 and nala_found_mention.confidence <= self.threshold:
-                                        yield pmid, doc
-
-                        if _lasttime - time.time() > 1:
-                            print_verbose('time intensive regex', i)
-                    sent_offset += 2 + sent_length
-
-                    # for per sentence positives
-                    if found_in_sentence:
-                        positive_sentences += 1
-
-                part_offset += sent_offset
-            if use_nala:
-                for part in nala_doc:
-                    for ann in part.predicted_annotations:
-                        if ann.subclass > 0:
-                            print_verbose(part.text[:ann.offset] + color.BOLD + ann.text + color.END + part.text[
-                                                                                                       ann.offset + len(
-                                                                                                           ann.text):])
-                            positive_sentences += min_found
             _old_time = _start_time
             _start_time = time.time()
             _one_time = _start_time - _old_time
 
-            if _one_time > 0.3 and positive_sentences > min_found:
+            if _one_time > 0.3 and keep:
                 _progress += 1
                 _total_time += _one_time
 
             _time_per_doc = _total_time / _progress
             print_verbose("PROGRESS: {:.2f} secs ETA per one positive document:"
                           " {:.2f} secs".format(_total_time, _time_per_doc))
-            print_debug('used regular expressions:', json.dumps(used_regexs, indent=4))
-            if positive_sentences >= min_found:
-                last_found = 0
+            if keep:
                 print_verbose('YEP', pmid)
                 yield pmid, doc
             else:
                 print_verbose('NOPE', pmid)
 
+        if PROFILE and self._pattern_calls > 0:
+            # only counts the scans done in this process
+            _time_avg_per_pattern = self._time_reg_pattern_total / self._pattern_calls  # avg spent time per pattern call
+            print_verbose('regex matches: {} total secs: {:.3f} avg secs per match: {:.6f}'.format(
+                self._pattern_calls, self._time_reg_pattern_total, _time_avg_per_pattern))
+
+    def _decide(self, pmid, doc, min_found, use_nala):
+        """
+        Runs the regexs (and nala if use_nala) on a single document.
+        Can run in a worker process, thus leaves self.cache untouched.
+
+        :returns (cache key, whether the document is kept)
+        """
+        # without nala the decision does not depend on the binary model
+        key = _document_cache_key(pmid, doc, self.location_binary_model if use_nala else None, self.pattern_file_name,
+                                  self.pattern_file_stamp, self.threshold, min_found, use_nala)
+        if key in self.cache:
+            return key, self.cache[key]
+
+        part_offset = 0
+        data_tmp = Dataset()
+        data_tmp.documents[pmid] = doc
+        NLTKSplitter().split(data_tmp)
+        # data_tmvar = TmVarTagger().generate_abstracts([pmid])
+        nala_doc = None
+        nala_found = False
+        if use_nala:
+            data_nala = _prediction_dataset(pmid, doc)
+            self.pipeline.execute(data_nala)
+            self.labeler.label(data_nala)
+            self.crf.tag(data_nala, MUT_CLASS_ID)
+            PostProcessing().process(data_nala)
+            ExclusiveNLDefiner().define(data_nala)
+            nala_doc = data_nala.documents.get(pmid)
+
+        used_regexs = {}
+
+        # lower case and strip all sentences of the document at once,
+        # each sentence then gets searched within its own bounds [sent_start, sent_end) of text
+        # (or as a string of its own if the patterns use anchors or lookbehinds)
+        text = _SENT_SEP.join(sent for part in doc.parts.values() for sent in part.sentences_)
+        text = text.lower().translate(_PUNCT_TABLE)
+
+        # ascii documents (most of them) get scanned as bytes, offsets stay the same as one char is one byte
+        union, prefilter, search_text = self.union, self.prefilter, text
+        if self.union_bytes is not None:
+            try:
+                search_text = text.encode('ascii')
+                union, prefilter = self.union_bytes, self.prefilter_bytes
+            except UnicodeEncodeError:
+                pass
+        sent_end = -1
+
+        positive_sentences = 0
+        decided = False
+        for i, (x, cur_part) in enumerate(doc.parts.items()):
+            # print("Part", i)
+            sent_offset = 0
+            sentences = cur_part.sentences_
+
+            for sent in sentences:
+                sent_length = len(sent)
+                sent_start = sent_end + 1
+                sent_end = text.find(_SENT_SEP, sent_start)
+                if sent_end == -1:
+                    sent_end = len(text)
+                # new_text = re.sub('\W+', ' ', new_text)
+
+                found_in_sentence = False
+
+                # sentences without any literal required by the patterns cannot match any of them
+                if self.window_safe:
+                    sent_text, pos, endpos = search_text, sent_start, sent_end
+                else:
+                    sent_text, pos, endpos = search_text[sent_start:sent_end], 0, sent_end - sent_start
+
+                if prefilter is not None and not prefilter.search(sent_text, pos, endpos):
+                    sent_offset += 2 + sent_length
+                    continue
+
+                if PROFILE:
+                    _lasttime = time.time()  # time start var
+                for reg, match in _finditer(self.patterns, union, sent_text, pos, endpos):
+                    # debug bottleneck patterns
+                    if PROFILE:
+                        _time_current_reg = time.time() - _lasttime  # time end var
+                        self._pattern_calls += 1  # pattern calls already occured
+                        self._time_reg_pattern_total += _time_current_reg  # total time spent on searching with patterns
+                        if _time_current_reg > 1:
+                            print_verbose('time intensive regex', reg.pattern)
+                    # todo create pattern performance eval for descending amount of recognized patterns
+                    # if self._pattern_calls > len(patterns) * 20 and _time_avg_per_pattern * 10000 < _time_current_reg:
+                    #     print("BAD_PATTERN_PERFORMANCE:", _time_avg_per_pattern, _time_current_reg, reg.pattern)
+                    # if _time_max_pattern < _time_current_reg:
+                    #     _time_max_pattern = _time_current_reg
+                    #     _low_performant_pattern = reg.pattern
+                    #     print(_time_avg_per_pattern, _low_performant_pattern, _time_max_pattern)
+
+                    # if reg.pattern == r'(\b\w*\d+\w*\b\s?){1,3} (\b\w+\b\s?){1,4} (\b\w*\d+\w*\b\s?){1,3} (\b\w+\b\s?){1,4} (deletion|deleting|deleted)':
+                    #     if _time_current_reg > _time_avg_per_pattern * 10:
+                    #         # print(_time_avg_per_pattern, _time_current_reg)
+                    #         f.write("BAD_PATTERN\n")
+                    #         f.write(sent + "\n")
+                    #         f.write(new_text + "\n")
+                    if match:
+                        # if pmid in data_tmvar.documents:
+                        #     anti_doc = data_tmvar.documents.get(pmid)
+
+                        start = part_offset + sent_offset + match.start() - pos
+                        end = part_offset + sent_offset + match.end() - pos
+                        # print("TmVar is not overlapping?:", not anti_doc.overlaps_with_mention(start, end))
+                        # print(not nala_doc.overlaps_with_mention(start, end, annotated=False))
+
+
+                        if reg.pattern in used_regexs:
+                            used_regexs[reg.pattern] += 1
+                        else:
+                            used_regexs[reg.pattern] = 1
+                        if _HIGHLIGHT_MATCHES:
+                            match_start, match_end = sent_start + match.start() - pos, sent_start + match.end() - pos
+                            print(color.PURPLE + text[sent_start:match_start] +
+                                  color.BOLD + color.DARKCYAN + color.UNDERLINE + text[match_start:match_end] + color.END +
+                                  color.PURPLE + text[match_end:sent_end] + color.END)
+                        if not found_in_sentence:
+                            positive_sentences += 1
+                            found_in_sentence = True
+                                        # if not anti_doc.overlaps_with_mention(start,
+                                        #                                       end) \
+                                        #         and not nala_doc.overlaps_with_mention(start, end, annotated=False):
+                                        #     _e_result = exclusive_definer.define_string(
+                                        #         new_text[match.span()[0]:match.span()[1]])
+                                        #     _e_array[_e_result] += 1
+                                        #     _i_result = inclusive_definer.define_string(
+                                        #         new_text[match.span()[0]:match.span()[1]])
+                                        #     _i_array[_i_result] += 1
+                                        # todo write to file param + saving to manually annotate and find tp + fp for performance eval on each pattern
+                                        # print("e{}\ti{}\t{}\t{}\t{}\n".format(_e_result, _i_result, sent, match, reg.pattern))
+
+                                        # last_found += 1
+                                        # found_in_sentence = True
+                            # else:
+                            #     # if nala not used only tmvar considered
+                            #     if not anti_doc.overlaps_with_mention(start, end):
+                            #         _e_result = exclusive_definer.define_string(
+                            #             new_text[match.span()[0]:match.span()[1]])
+                            #         _e_array[_e_result] += 1
+                            #         _i_result = inclusive_definer.define_string(
+                            #             new_text[match.span()[0]:match.span()[1]])
+                            #         _i_array[_i_result] += 1
+                            #         # todo write to file param + saving to manually annotate and find tp + fp for performance eval on each pattern
+                            #         # print("e{}\ti{}\t{}\t{}\t{}\n".format(_e_result, _i_result, sent, match, reg.pattern))
+                            #         last_found += 1
+                            #         found_in_sentence = True
+
+                        if use_nala:
+                            nala_found_mention = nala_doc.overlaps_with_mention(start, end, annotated=False)
+                            if nala_found_mention:
+                                print_verbose(nala_found_mention)
+                                if nala_found_mention.subclass > 0 and nala_found_mention.confidence <= self.threshold:
+                                    nala_found = True
+                                    # the document is kept anyway, further matches in this sentence change nothing
+                                    break
+                        elif not is_debug_mode:
+                            # only whether the sentence matches counts (debug mode prints how often each regex matched)
+                            break
+
+                    if PROFILE:
+                        _lasttime = time.time()
+                sent_offset += 2 + sent_length
+
+                decided = nala_found or (not use_nala and not is_debug_mode and positive_sentences >= min_found)
+                if decided:
+                    break
+
+            part_offset += sent_offset
+            if decided:
+                break
+        if use_nala:
+            for part in nala_doc:
+                for ann in part.predicted_annotations:
+                    if ann.subclass > 0:
+                        print_verbose(part.text[:ann.offset] + color.BOLD + ann.text + color.END + part.text[
+                                                                                                   ann.offset + len(
+                                                                                                       ann.text):])
+                        positive_sentences += min_found
+        if is_debug_mode:
+            print_debug('used regular expressions:', json.dumps(used_regexs, separators=(',', ':')))
+        return key, nala_found or positive_sentences >= min_found
+
+    @property
+    def pipeline(self):
+        """ best setting (features, etc.) for tagging, built on first use in each process and only if use_nala """
+        if self._pipeline is None:
+            self._pipeline = get_prepare_pipeline_for_best_model()
+        return self._pipeline
+
+    @property
+    def crf(self):
+        """ nala tagger, opened on first use in each process """
+        if self._crf is None:
+            self._crf = PyCRFSuite(self.location_binary_model)
+        return self._crf
+
 
 class color:
     PURPLE = '\033[95m'
@@ -1,32 +1,170 @@
-import glob
+import hashlib
 import json
+import multiprocessing
 import os
+import pickle
 import re
 import time
 import csv
+import requests
 
 from collections import defaultdict
-from itertools import product, chain, count
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+from itertools import chain
 from nala.bootstrapping.utils import UniprotDocumentSelector, PMIDDocumentSelector
 from nala.structures.selection_pipelines import DocumentSelectorPipeline
 from nala.bootstrapping.document_filters import HighRecallRegexDocumentFilter, ManualDocumentFilter, ManualStatsDocumentFilter
 from nala.bootstrapping.pmid_filters import AlreadyConsideredPMIDFilter
 from nala.learning.postprocessing import PostProcessing
-from nalaf import print_verbose, print_debug
+from nalaf import print_verbose, print_debug, is_verbose_mode
 from nalaf.learning.crfsuite import PyCRFSuite
-from nala.utils import nala_repo_path
+from nala.utils import nala_repo_path, MUT_CLASS_ID, THRESHOLD_VALUE, get_prepare_pipeline_for_best_model
 from nalaf.utils.annotation_readers import AnnJsonAnnotationReader, AnnJsonMergerAnnotationReader
 from nalaf.utils.readers import HTMLReader
 from nalaf.preprocessing.labelers import BIEOLabeler
 from nalaf.learning.evaluators import MentionLevelEvaluator
 from nalaf.utils.writers import TagTogFormat
 from nala.preprocessing.definers import ExclusiveNLDefiner
-from nala.utils import MUT_CLASS_ID, THRESHOLD_VALUE
-from nalaf.structures.data import Entity
 from nalaf.domain.bio.gnormplus import GNormPlusGeneTagger
+from nalaf.utils.ncbi_utils import GNormPlus
 from nalaf.structures.data import Dataset
+from nalaf.structures.dataset_pipelines import PrepareDatasetPipeline
 
-from nala.utils import get_prepare_pipeline_for_best_model
+_BUCKET_SIZE = 32
+""" width in characters of the offset buckets that entities get indexed by to find overlapping ones """
+
+_REVIEWED_DOCID = re.compile(r'.*-(\d+)\.')
+""" document id in the name of a reviewed file, e.g. the 123 in sth-123.ann.json """
+
+
+def _offset_buckets(entity):
+    """
+    :returns range of the offset buckets the characters of the entity fall into (at least one)
+    """
+    return range(entity.offset // _BUCKET_SIZE, (entity.offset + max(len(entity.text), 1) - 1) // _BUCKET_SIZE + 1)
+
+
+def _overlapping(entity, other):
+    """
+    :returns whether the two entities are of the same class and share at least one character,
+    the same as Entity.__eq__ with the 'exact_or_overlapping' equality operator but without depending on it
+    """
+    return (entity.class_id == other.class_id and
+            entity.offset < other.offset + len(other.text) and other.offset < entity.offset + len(entity.text))
+
+
+def _match_entities(annotations, predictions):
+    """
+    Pairs each annotation with every prediction it overlaps with.
+    Predictions are indexed by offset buckets so that an annotation only gets compared
+    to the predictions close to it instead of to all of them.
+
+    :returns (list of matched (annotation, prediction), unmatched annotations, unmatched predictions)
+    """
+    buckets = defaultdict(list)
+    for index, pred in enumerate(predictions):
+        for bucket in _offset_buckets(pred):
+            buckets[bucket].append(index)
+
+    matched = []
+    matched_pred = set()
+    not_found_ann = []
+    for ann in annotations:
+        candidates = set()
+        for bucket in _offset_buckets(ann):
+            candidates.update(buckets.get(bucket, ()))
+
+        found = False
+        for index in sorted(candidates):
+            if _overlapping(ann, predictions[index]):
+                matched.append((ann, predictions[index]))
+                matched_pred.add(index)
+                found = True
+        if not found:
+            not_found_ann.append(ann)
+
+    not_found_pred = [pred for index, pred in enumerate(predictions) if index not in matched_pred]
+    return matched, not_found_ann, not_found_pred
+
+
+def _walk_files(folder, follow_symlinks=False):
+    """
+    Yields the os.DirEntry of each file within folder and its subfolders.
+    Like os.walk, symbolic links to folders are neither followed nor yielded unless follow_symlinks.
+    """
+    folders = [folder]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=follow_symlinks):
+                    folders.append(entry.path)
+                elif not entry.is_dir():
+                    yield entry
+
+
+def _html_document_ids(folder):
+    """
+    :returns set of the ids of the documents nalaf's HTMLReader would read from folder, without parsing any html
+    (the id is the part of the file name after the last '-' and before .plain.html, .html or .xml),
+    as with the glob of HTMLReader hidden files are skipped and symbolic links to folders are followed
+    """
+    if not os.path.isdir(folder):
+        raise FileNotFoundError('The html folder does not exist.', folder)
+
+    ids = set()
+    for entry in _walk_files(folder, follow_symlinks=True):
+        if entry.name.endswith(('.html', '.xml')) and not entry.name.startswith('.'):
+            docid = entry.name.replace('.plain.html', '').replace('.html', '').replace('.xml', '')
+            ids.add(docid.split('-')[-1])
+    return ids
+
+
+def _latest_modification(folders):
+    """
+    :returns latest modification time of the given folders and of anything within them, 0 if none exists
+    """
+    latest = 0
+    for folder in folders:
+        for dirpath, dirnames, filenames in os.walk(folder):
+            latest = max(latest, os.path.getmtime(dirpath), *(os.path.getmtime(os.path.join(dirpath, x)) for x in filenames))
+    return latest
+
+
+def _prefetch_gnormplus(pmids, max_workers=8):
+    """
+    Requests the GNormPlus results of the pmids that are not cached yet with several threads at once
+    and saves them into the GNormPlus cache, where GNormPlusGeneTagger then reads them from
+    instead of requesting one document after another.
+    """
+    with GNormPlus() as gnorm:
+        missing = [pmid for pmid in pmids if pmid not in gnorm.cache]
+        if missing:
+            with ThreadPoolExecutor(min(max_workers, len(missing))) as executor:
+                texts = executor.map(lambda pmid: requests.get(gnorm.url.format(pmid)).text, missing)
+                for pmid, text in zip(missing, texts):
+                    gnorm.cache[pmid] = text
+
+
+def _column_sums(rows):
+    """
+    :returns list with the sum of each column of the rows
+    """
+    return [sum(col) for col in zip(*rows)]
+
+
+_fold_function = None
+""" function that a worker process of cross validation applies to the fold numbers it gets """
+
+
+def _init_fold_worker(function):
+    global _fold_function
+    _fold_function = function
+
+
+def _run_fold(fold):
+    return _fold_function(fold)
 
 
 class IterationRound:
@@ -38,6 +176,9 @@ class IterationRound:
 
     bootstrapping_folder = nala_repo_path(["resources", "bootstrapping"])
 
+    _FOLDER_NAME = re.compile('iteration_(([0-9]+).*)$')
+    """ name of an iteration folder, capturing the name and the number of the iteration """
+
     def __init__(self, name, number=None, path=None):
         self.name = str(name)
         match = re.search('([0-9]+).*$', self.name)
@@ -63,6 +204,16 @@ class IterationRound:
         return (os.path.isdir(os.path.join(self.path, 'candidates')) and
             os.path.isdir(os.path.join(self.path, 'reviewed')))
 
+    def source_folders(self):
+        """
+        :returns (html folder, annjson folder) the iteration gets read from
+        """
+        if self.is_seed():
+            base_folder = os.path.join(self.path, 'base')
+            return os.path.join(base_folder, 'html'), os.path.join(base_folder, 'annjson')
+        else:
+            return os.path.join(self.path, 'candidates', 'html'), os.path.join(self.path, 'reviewed')
+
     def __str__(self):
         return "Iteration: {} : {}".format(self.name, self.path)
 
@@ -73,11 +224,9 @@ class IterationRound:
         print_debug(self)
         dataset = None
 
-        if self.is_seed():
-            base_folder = os.path.join(self.path, 'base')
-            html_folder = os.path.join(base_folder, 'html')
-            annjson_folder = os.path.join(base_folder, 'annjson')
+        html_folder, annjson_folder = self.source_folders()
 
+        if self.is_seed():
             dataset = HTMLReader(html_folder).read()
             if read_annotations:
                 AnnJsonMergerAnnotationReader(
@@ -89,10 +238,6 @@ class IterationRound:
                     delete_incomplete_docs=True).annotate(dataset)
 
         elif self.is_IAA():
-            base_folder = self.path
-            html_folder = os.path.join(base_folder, 'candidates', 'html')
-            annjson_folder = os.path.join(base_folder, 'reviewed')
-
             dataset = HTMLReader(html_folder).read()
             if read_annotations:
                 AnnJsonMergerAnnotationReader(
@@ -104,10 +249,6 @@ class IterationRound:
                     delete_incomplete_docs=False).annotate(dataset)
 
         else:
-            base_folder = self.path
-            html_folder = os.path.join(base_folder, 'candidates', 'html')
-            annjson_folder = os.path.join(base_folder, 'reviewed')
-
             dataset = HTMLReader(html_folder).read()
             if read_annotations:
                 AnnJsonAnnotationReader(annjson_folder, read_only_class_id=MUT_CLASS_ID, delete_incomplete_docs=False, read_relations=self.is_random()).annotate(dataset)
@@ -118,13 +259,17 @@ class IterationRound:
     @staticmethod
     def all(including_seed=True):
         ret = []
-        for fn in glob.glob(IterationRound.bootstrapping_folder + "/iteration_*/"):
-            match = re.search('iteration_(([0-9]+).*)/$', fn)
-            if match:
-                ret.append(IterationRound(
-                    name=match.group(1),
-                    number=int(match.group(2)),
-                    path=fn))
+        if not os.path.isdir(IterationRound.bootstrapping_folder):
+            return ret
+
+        with os.scandir(IterationRound.bootstrapping_folder) as entries:
+            for entry in entries:
+                match = IterationRound._FOLDER_NAME.match(entry.name)
+                if match and entry.is_dir():
+                    ret.append(IterationRound(
+                        name=match.group(1),
+                        number=int(match.group(2)),
+                        path=entry.path))
 
         ret.sort(key=lambda x: x.number)
 
@@ -140,7 +285,7 @@ class IterationRound:
         # check for candidates and reviewed
         if last.number == 0:
             return 1
-        elif last.is_reviewed:
+        elif last.is_reviewed():
             return last.number + 1
         else:
             return last.number
@@ -180,6 +325,7 @@ class Iteration:
         self.train = None  # first
         self.candidates = None  # non predicted docselected
         self.predicted = None  # predicted docselected
+        self._tagged_candidates = None  # candidates the predictions were last made for
         self.crf = PyCRFSuite()
 
         # preparedataset pipeline init
@@ -417,17 +563,16 @@ class Iteration:
 
         return doc_filter
 
-    def docselection(self, nr=2, just_caching=False):
+    def docselection(self, nr=2, just_caching=False, n_jobs=1):
         """
         Does the same as generate_documents(n) but the bootstrapping folder is specified in here.
         :param nr: amount of new documents wanted
+        :param n_jobs: number of processes the regex document filter runs in, 1 filters in this process
         """
         print_verbose("\n\n\n======DocSelection======\n\n\n")
 
-
-        c = count(1)
-
-        dataset = Dataset()
+        found = 0
+        selected = []
 
         if just_caching:
             _counter = 0
@@ -440,47 +585,54 @@ class Iteration:
                 _already_downloaded = 0
                 for pmid, document in dsp.execute():
 
-                    dataset.documents[pmid] = document
-
-                    _counter += 1
-                    _tmptime = time.perf_counter()
-                    _one_it = _tmptime - _starttime
-                    _starttime = _tmptime
-
-                    if _one_it < 0.25:  # check if not already downloaded (for eta calculation)
-                        _already_downloaded += 1
-                        _counter -= 1
-                        _total -= _one_it
-
-                    _total += _one_it
-                    # print_verbose('total', _total)
-                    if _counter > 0:
-                        _eta_one = _total / _counter
-                        _counter_left = nr - _counter - _already_downloaded
-                        _eta_left = _eta_one * _counter_left
-                        print_verbose(
-                            'NrOfDocs: {} | ETA Left for {}: {:.3f} | ETA One for One: {:.3f}'.format(_counter, _counter_left,
-                                                                                          _eta_left, _eta_one))
+                    selected.append((pmid, document))
+                    found += 1
+
+                    # the eta only gets printed in verbose mode
+                    if is_verbose_mode:
+                        _counter += 1
+                        _tmptime = time.perf_counter()
+                        _one_it = _tmptime - _starttime
+                        _starttime = _tmptime
+
+                        if _one_it < 0.25:  # check if not already downloaded (for eta calculation)
+                            _already_downloaded += 1
+                            _counter -= 1
+                            _total -= _one_it
+
+                        _total += _one_it
+                        # print_verbose('total', _total)
+                        if _counter > 0:
+                            _eta_one = _total / _counter
+                            _counter_left = nr - _counter - _already_downloaded
+                            _eta_left = _eta_one * _counter_left
+                            print_verbose(
+                                'NrOfDocs: {} | ETA Left for {}: {:.3f} | ETA One for One: {:.3f}'.format(_counter, _counter_left,
+                                                                                              _eta_left, _eta_one))
 
                     # if we have generated enough documents stop
-                    if next(c) == nr:
+                    if found >= nr:
                         break
         else:
             with DocumentSelectorPipeline(
                     document_selector=UniprotDocumentSelector(),
                     pmid_filters=[AlreadyConsideredPMIDFilter(self.bootstrapping_folder, self.number)],
                     document_filters=[HighRecallRegexDocumentFilter(binary_model=self.bin_model,
-                                                                    expected_max_results=nr, use_nala=True),
+                                                                    expected_max_results=nr, use_nala=True,
+                                                                    n_jobs=n_jobs),
                                       ManualDocumentFilter()]) as dsp:
                 for pmid, document in dsp.execute():
-                    dataset.documents[pmid] = document
-                    lendata = len(dataset.documents)
-                    print_verbose('Already {} documents found. {} more to go.'.format(lendata, nr - lendata))
+                    selected.append((pmid, document))
+                    found += 1
+                    if is_verbose_mode:
+                        print_verbose('Already {} documents found. {} more to go.'.format(found, nr - found))
 
                     # if we have generated enough documents stop
-                    if next(c) == nr:
+                    if found >= nr:
                         break
 
+        dataset = Dataset()
+        dataset.documents.update(selected)
         self.candidates = dataset
         len_cand = len(self.candidates)
         if len_cand < nr:
@@ -490,12 +642,16 @@ class Iteration:
     def tagging(self, threshold_val=THRESHOLD_VALUE):
         print_verbose("\n\n\n======Tagging======\n\n\n")
 
-        self.pipeline.execute(self.candidates)
-        self.crf.tag(self.candidates, self.bin_model, MUT_CLASS_ID)
-        PostProcessing().process(self.candidates)
-        GNormPlusGeneTagger().tag(self.candidates)
+        # the predictions do not depend on the threshold, already tagged candidates only get exported again
+        if self._tagged_candidates is not self.candidates:
+            self.pipeline.execute(self.candidates)
+            self.crf.tag(self.candidates, self.bin_model, MUT_CLASS_ID)
+            PostProcessing().process(self.candidates)
+            _prefetch_gnormplus(self.candidates.documents.keys())
+            GNormPlusGeneTagger().tag(self.candidates)
 
-        self.candidates.validate_entity_offsets()
+            self.candidates.validate_entity_offsets()
+            self._tagged_candidates = self.candidates
 
         # export to anndoc format
         ttf_candidates = TagTogFormat(self.candidates, use_predicted=True, to_save_to=self.candidates_folder, use_original_partids=False)
@@ -523,168 +679,211 @@ class Iteration:
         """
         ExclusiveNLDefiner().define(self.reviewed)
 
-        # debug results / annotations
-        results = []
+        # debug results / annotations, the widths of the columns have to be known before the first row gets written
+        annotated_width = predicted_width = 1
         for part in self.reviewed.parts():
-            not_found_ann = part.annotations[:]
-            not_found_pred = part.predicted_annotations[:]
-            for ann, pred in product(part.annotations, part.predicted_annotations):
-                Entity.equality_operator = 'exact_or_overlapping'
-                if ann == pred:
-                    results.append((ann, pred))
-
-                    # delete found elements
-                    if ann in not_found_ann:
-                        index = not_found_ann.index(ann)
-                        del not_found_ann[index]
-
-                    if pred in not_found_pred:
-                        index = not_found_pred.index(pred)
-                        del not_found_pred[index]
-            results += [(ann, Entity(class_id='e_2', offset=-1, text='')) for ann in not_found_ann]
-            results += [(Entity(class_id='e_2', offset=-1, text=''), pred) for pred in not_found_pred]
-
-        annotated_format = "{:<" + str(max(chain(len(x.text) for x in self.reviewed.annotations()))) + "}"
-        predicted_format = "{:<" + str(max(chain(len(x.text) for x in self.reviewed.predicted_annotations()))) + "}"
-        row_format = annotated_format + '\t|\t' + predicted_format + "\n"
+            for ann in part.annotations:
+                annotated_width = max(annotated_width, len(ann.text))
+            for pred in part.predicted_annotations:
+                predicted_width = max(predicted_width, len(pred.text))
+
+        # the subclass analysis also yields the overall exact measures, thus the dataset is evaluated once per strictness
+        subclass_measures, exact_measures = MentionLevelEvaluator(subclass_analysis=True).evaluate(self.reviewed)
 
         with open(self.results_file, 'w', encoding='utf-8') as f:
-            f.write(row_format.format('=====Annotated=====', '=====Predicted====='))
-            for tuple in ((x[0].text, x[1].text) for x in results):
-                f.write(row_format.format(*tuple))
+            def write_row(annotated, predicted):
+                f.write(annotated.ljust(annotated_width) + '\t|\t' + predicted.ljust(predicted_width) + '\n')
+
+            write_row('=====Annotated=====', '=====Predicted=====')
+            for part in self.reviewed.parts():
+                matched, not_found_ann, not_found_pred = _match_entities(part.annotations, part.predicted_annotations)
+                for ann, pred in matched:
+                    write_row(ann.text, pred.text)
+                for ann in not_found_ann:
+                    write_row(ann.text, '')
+                for pred in not_found_pred:
+                    write_row('', pred.text)
             f.write('-'*80)
             f.write('\n\n=====Detailed Results=====\n')
             f.write(
                 'Exact:            TP={}\tFP={}\tFN={}\tFP_OVERLAP={}\tFN_OVERLAP={}\tPREC={:.3%}\tRECALL={:.3%}\tF-MEAS={:.3%}\n'.format(
-                    *MentionLevelEvaluator().evaluate(self.reviewed)))
+                    *exact_measures))
             f.write(
                 'Overlapping:      TP={}\tFP={}\tFN={}\tFP_OVERLAP={}\tFN_OVERLAP={}\tPREC={:.3%}\tRECALL={:.3%}\tF-MEAS={:.3%}\n'.format(
                     *MentionLevelEvaluator(strictness='overlapping').evaluate(self.reviewed)))
             f.write(
                 'Half-Overlapping: TP={}\tFP={}\tFN={}\tFP_OVERLAP={}\tFN_OVERLAP={}\tPREC={:.3%}\tRECALL={:.3%}\tF-MEAS={:.3%}\n'.format(
                     *MentionLevelEvaluator(strictness='half_overlapping').evaluate(self.reviewed)))
-            subclass_string = json.dumps(MentionLevelEvaluator(subclass_analysis=True).evaluate(self.reviewed)[0],
-                                         indent=4, sort_keys=True)
+            subclass_string = json.dumps(subclass_measures, indent=4, sort_keys=True)
             f.write('Raw-Data:\n{}'.format(subclass_string))
 
         # optional containing sentence
         # optional containing document-id
         # optional group according to subclass (different sizes)
 
-    def cross_validation(self, split):
+    def read_cross_validation_data(self):
         """
-        does k fold cross validation with split being k
-        :param split: int
+        Reads base + iterations 1..n-1, the data cross validation is done on.
+        The parsed dataset is pickled into the nalaf cache directory (~/.nalaf), one file per iteration folder,
+        and reused from there as long as none of the read html and annjson files has changed.
         """
-        base_folder = os.path.join(os.path.join(self.bootstrapping_folder, 'iteration_0'), 'base')
-        data = HTMLReader(os.path.join(base_folder, 'html')).read()
-        AnnJsonMergerAnnotationReader(os.path.join(os.path.join(base_folder, 'annjson'), 'members'),
-                                      read_only_class_id=MUT_CLASS_ID,
-                                      strategy='intersection', entity_strategy='priority',
-                                      priority = ['Ectelion', 'abojchevski', 'sanjeevkrn', 'Shpendi'],
-                                      delete_incomplete_docs=True).annotate(data)
+        rounds = [IterationRound(number, path=os.path.join(self.bootstrapping_folder, "iteration_{}".format(number)))
+                  for number in range(self.number)]
+        stamp = (self.number, _latest_modification(folder for itr in rounds for folder in itr.source_folders()))
+        cache_directory = os.path.join(os.path.expanduser('~'), '.nalaf')
+        os.makedirs(cache_directory, exist_ok=True)
+        folder_hash = hashlib.sha1(os.path.abspath(self.current_folder).encode('utf-8')).hexdigest()
+        cache_file = os.path.join(cache_directory, 'cross_validation_data_{}.pickle'.format(folder_hash))
+
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                if pickle.load(f) == stamp:
+                    data = pickle.load(f)
+                    print_verbose(len(data), 'documents in total, read from', cache_file)
+                    return data
+
+        data = rounds[0].read()
         print_verbose(len(data), 'documents in base')
+        for itr in rounds[1:]:
+            data.extend_dataset(itr.read())
+        print_verbose(len(data), 'documents in total')
 
-        for fold in range(1, self.number):
-            iteration_base = os.path.join(self.bootstrapping_folder, "iteration_{}".format(fold))
+        with open(cache_file, 'wb') as f:
+            pickle.dump(stamp, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
 
-            tmp_data = HTMLReader(os.path.join(os.path.join(iteration_base, 'candidates'), 'html')).read()
-            AnnJsonAnnotationReader(os.path.join(iteration_base, 'reviewed'), read_only_class_id=MUT_CLASS_ID, delete_incomplete_docs=False).annotate(tmp_data)
-            data.extend_dataset(tmp_data)
-        print_verbose(len(data), 'documents in total')
+        return data
 
-        last_iteration = os.path.join(self.bootstrapping_folder, "iteration_{}".format(self.number-1))
-        cv_file = os.path.join(last_iteration, 'cross_validation.csv')
-        with open(cv_file, 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['fold', 'strictness', 'sublcass',
-                             'tp', 'fp', 'fn', 'fp_overlap', 'fn_overlap',
-                             'precision', 'recall', 'f1-score'])
+    def _cross_validation_fold(self, folds, evaluators, fold):
+        """
+        Trains on and evaluates a single fold of cross validation with a model of its own.
+        Can run in a worker process.
+
+        The folds share their documents (nalaf's cv_split does not copy them), pruning, features,
+        labels and predictions thus go into a copy of the fold so that no fold sees what another one did
+        and the results do not depend on the order (or the process) the folds run in.
+
+        :returns [(subclass measures, measures) of each evaluator]
+        """
+        print_verbose('starting with fold:', fold)
+        train, test = deepcopy(folds[fold])
+        model_file = 'cross_validation_model_{}'.format(fold)
+
+        train.prune_empty_parts()
+        self.pipeline.execute(train)
+        self.labeler.label(train)
+        self.crf.train(train, model_file)
+
+        self.pipeline.execute(test)
+        self.labeler.label(test)
+        self.crf.tag(test, model_file)
+
+        ExclusiveNLDefiner().define(test)
+        PostProcessing().process(test)
+
+        return [evaluator.evaluate(test) for evaluator in evaluators]
+
+    def cross_validation(self, split, n_jobs=1):
+        """
+        does k fold cross validation with split being k
+        :param split: int
+        :param n_jobs: number of processes to train and evaluate the folds in parallel, 1 runs them one after another
+        """
+        data = self.read_cross_validation_data()
 
         folds_results_exact = []
         folds_results_overlapping = []
         subclass_averages_exact = defaultdict(list)
         subclass_averages_overlapping = defaultdict(list)
 
-        for fold, (train, test) in enumerate(data.cv_split(5)):
-            print_verbose('starting with fold:', fold)
+        exact_evaluator = MentionLevelEvaluator(strictness='exact', subclass_analysis=True)
+        overlapping_evaluator = MentionLevelEvaluator(strictness='overlapping', subclass_analysis=True)
 
-            train.prune_empty_parts()
-            self.pipeline.execute(train)
-            BIEOLabeler().label(train)
-            self.crf.train(train, 'cross_validation_model')
+        folds = list(data.cv_split(split))
+        run_fold = partial(self._cross_validation_fold, folds, (exact_evaluator, overlapping_evaluator))
 
-            self.pipeline.execute(test)
-            BIEOLabeler().label(test)
-            self.crf.tag(test, 'cross_validation_model')
-
-            ExclusiveNLDefiner().define(test)
-            PostProcessing().process(test)
+        last_iteration = os.path.join(self.bootstrapping_folder, "iteration_{}".format(self.number-1))
+        cv_file = os.path.join(last_iteration, 'cross_validation.csv')
+        with open(cv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['fold', 'strictness', 'sublcass',
+                             'tp', 'fp', 'fn', 'fp_overlap', 'fn_overlap',
+                             'precision', 'recall', 'f1-score'])
 
-            with open(cv_file, 'a', newline='') as file:
-                writer = csv.writer(file)
+            if n_jobs <= 1:
+                folds_evaluations = map(run_fold, range(len(folds)))
+            else:
+                # the folds are handed to the workers once when they start (not pickled with the fork start method)
+                with multiprocessing.Pool(min(n_jobs, len(folds)), initializer=_init_fold_worker, initargs=(run_fold,)) as pool:
+                    folds_evaluations = pool.map(_run_fold, range(len(folds)), 1)
 
-                subclass_measures, results = MentionLevelEvaluator(strictness='exact', subclass_analysis=True).evaluate(test)
+            for fold, (exact_evaluation, overlapping_evaluation) in enumerate(folds_evaluations):
+                subclass_measures, results = exact_evaluation
                 for subclass, measures in subclass_measures.items():
                     writer.writerow(list(chain([fold, 'exact', int(subclass)], measures)))
                     subclass_averages_exact[subclass].append(measures)
                 writer.writerow(list(chain([fold, 'exact', 'total'], results)))
                 folds_results_exact.append(results)
 
-                subclass_measures, results = MentionLevelEvaluator(strictness='overlapping', subclass_analysis=True).evaluate(test)
+                subclass_measures, results = overlapping_evaluation
                 for subclass, measures in subclass_measures.items():
                     writer.writerow(list(chain([fold, 'overlapping', int(subclass)], measures)))
                     subclass_averages_overlapping[subclass].append(measures)
                 writer.writerow(list(chain([fold, 'overlapping', 'total'], results)))
                 folds_results_overlapping.append(results)
 
-        # calculate and write average of folds
-        with open(cv_file, 'a', newline='') as file:
-            writer = csv.writer(file)
+            # sum up the columns (tp, fp, etc. and measures) of the folds once for both the averages and the sum of folds
+            subclass_sums_exact = {subclass: _column_sums(x) for subclass, x in subclass_averages_exact.items()}
+            subclass_sums_overlapping = {subclass: _column_sums(x) for subclass, x in subclass_averages_overlapping.items()}
+            total_sums_exact = _column_sums(folds_results_exact)
+            total_sums_overlapping = _column_sums(folds_results_overlapping)
+
+            # calculate average of folds
+            rows = []
             # ================== EXACT =================
-            for subclass, averages in subclass_averages_exact.items():
-                writer.writerow(list(chain(['average', 'exact', subclass],
-                                           [sum(col)/len(col) for col in zip(*averages)])))
+            for subclass, sums in subclass_sums_exact.items():
+                rows.append(list(chain(['average', 'exact', subclass],
+                                       [x/len(subclass_averages_exact[subclass]) for x in sums])))
             # average out everything in the columns
-            writer.writerow(list(chain(['average', 'exact', 'total'],
-                                       [sum(col)/len(col) for col in zip(*folds_results_exact)])))
+            rows.append(list(chain(['average', 'exact', 'total'],
+                                   [x/len(folds_results_exact) for x in total_sums_exact])))
 
             # =============== OVERLAPPING ===============
-            for subclass, averages in subclass_averages_overlapping.items():
-                writer.writerow(list(chain(['average', 'overlapping', subclass],
-                                           [sum(col)/len(col) for col in zip(*averages)])))
+            for subclass, sums in subclass_sums_overlapping.items():
+                rows.append(list(chain(['average', 'overlapping', subclass],
+                                       [x/len(subclass_averages_overlapping[subclass]) for x in sums])))
             # average out everything in the columns
-            writer.writerow(list(chain(['average', 'overlapping', 'total'],
-                                       [sum(col)/len(col) for col in zip(*folds_results_overlapping)])))
+            rows.append(list(chain(['average', 'overlapping', 'total'],
+                                   [x/len(folds_results_overlapping) for x in total_sums_overlapping])))
 
             # =============== sum of folds ===============
             # sum up the counts (tp, fp, etc.) and then calculate the measures
-            for subclass, averages in subclass_averages_exact.items():
-                writer.writerow(list(chain(['sum_of_folds', 'exact', subclass],
-                                           MentionLevelEvaluator(strictness='exact').calc_measures(
-                                                   *[sum(col) for col in zip(*averages)][:5]))))
-            writer.writerow(list(chain(['sum_of_folds', 'exact', 'total'],
-                                       MentionLevelEvaluator(strictness='exact').calc_measures(
-                                               *[sum(col) for col in zip(*folds_results_exact)][:5]))))
-
-            with open(self.stats_file, 'a',  newline='') as stats_write_file:
-                stats_writer = csv.writer(stats_write_file)
-                for subclass, averages in subclass_averages_exact.items():
-                    stats = MentionLevelEvaluator(strictness='overlapping').calc_measures(
-                            *[sum(col) for col in zip(*averages)][:5])
-                    writer.writerow(list(chain(['sum_of_folds', 'overlapping', subclass], stats)))
-                    stats_writer.writerow([self.number-1, subclass, self.threshold_val] + list(stats))
-
-                stats = MentionLevelEvaluator(strictness='overlapping').calc_measures(
-                        *[sum(col) for col in zip(*folds_results_exact)][:5])
-                writer.writerow(list(chain(['sum_of_folds', 'overlapping', 'total'], stats)))
-                stats_writer.writerow([self.number-1, 'total', self.threshold_val] + list(stats))
+            for subclass, sums in subclass_sums_exact.items():
+                rows.append(list(chain(['sum_of_folds', 'exact', subclass],
+                                       exact_evaluator.calc_measures(*sums[:5]))))
+            rows.append(list(chain(['sum_of_folds', 'exact', 'total'],
+                                   exact_evaluator.calc_measures(*total_sums_exact[:5]))))
+
+            # the overlapping sum of folds also goes into the stats file
+            stats_rows = []
+            for subclass, sums in chain(subclass_sums_overlapping.items(), [('total', total_sums_overlapping)]):
+                stats = overlapping_evaluator.calc_measures(*sums[:5])
+                rows.append(list(chain(['sum_of_folds', 'overlapping', subclass], stats)))
+                stats_rows.append([self.number-1, subclass, self.threshold_val] + list(stats))
+
+            writer.writerows(rows)
+
+        with open(self.stats_file, 'a', newline='') as stats_write_file:
+            csv.writer(stats_write_file).writerows(stats_rows)
 
     def clean_reviewed_files(self):
-        import re
-        candidates = HTMLReader(os.path.join(self.candidates_folder, 'html')).read()
-        for (dirpath, dirnames, filenames) in os.walk(self.reviewed_folder):
-            for filename in filenames:
-                docid = re.sub(r'.*-(\d+)\..*', r'\1', filename)
-                if docid not in candidates.documents.keys():
-                    os.remove(os.path.join(dirpath, filename))
+        docids = _html_document_ids(os.path.join(self.candidates_folder, 'html'))
+        if not os.path.isdir(self.reviewed_folder):
+            return
+
+        for entry in _walk_files(self.reviewed_folder):
+            match = _REVIEWED_DOCID.match(entry.name)
+            # files without a document id are removed as well
+            docid = match.group(1) if match else entry.name
+            if docid not in docids:
+                os.remove(entry.path)
@@ -0,0 +1,128 @@
+import json
+import os
+import re
+import pkg_resources
+import tempfile
+import unittest
+
+from nalaf.structures.data import Document, Part
+
+from nala.bootstrapping.document_filters import _required_literals, _compile_prefilter, sre_parse
+from nala.bootstrapping.document_filters import HighRecallRegexDocumentFilter, HighRecallRegexClassifier
+from nala.bootstrapping.document_filters import KeywordsDocumentFilter
+
+
+def _document(*texts):
+    doc = Document()
+    for i, text in enumerate(texts):
+        doc.parts['p{}'.format(i)] = Part(text)
+    return doc
+
+
+class TestRequiredLiterals(unittest.TestCase):
+    def required(self, pattern):
+        return _required_literals(sre_parse.parse(pattern))
+
+    def test_literal(self):
+        self.assertEqual({'mutation'}, self.required('mutation'))
+        self.assertEqual({' mutation'}, self.required(r'\d+ mutation\w*'))
+
+    def test_branch(self):
+        self.assertEqual({'deletion', 'insertion'}, self.required('(deletion|insertion)'))
+
+    def test_branch_with_empty_alternative(self):
+        self.assertEqual({'ation'}, self.required('(mut|)ation'))
+        self.assertIsNone(self.required('(mut|)'))
+
+    def test_optional_repeats(self):
+        self.assertEqual({'ertion'}, self.required('ins?ertion'))
+        self.assertEqual({'xy'}, self.required('(abc){0,3}xy'))
+        self.assertIsNone(self.required('(abc)?'))
+        self.assertIsNone(self.required('(abc){0,3}'))
+        self.assertEqual({'abc'}, self.required('(abc){1,3}x'))
+
+    def test_nested_subpattern(self):
+        self.assertEqual({'deletion', 'insertion'}, self.required('((deletion|insertion) of)'))
+        self.assertEqual({'deletion', 'insertion'}, self.required('(((deletion)|(insertion))+)'))
+
+    def test_no_literal(self):
+        self.assertIsNone(self.required(r'\d+[a-z]'))
+        self.assertIsNone(self.required(r'(\w+|\d)'))
+
+
+class TestCompilePrefilter(unittest.TestCase):
+    def test_prefilter(self):
+        prefilter = _compile_prefilter([re.compile('(deletion|insertion) of'), re.compile(r'\d+ mutation')])
+        self.assertTrue(prefilter.search('an Insertion of 3 bases'))
+        self.assertTrue(prefilter.search('the 3 mutations'))
+        self.assertFalse(prefilter.search('a substitution'))
+
+    def test_redundant_literal(self):
+        prefilter = _compile_prefilter([re.compile('mutation'), re.compile(r'mut\w+')])
+        self.assertEqual('mut', prefilter.pattern)
+
+    def test_no_patterns(self):
+        self.assertIsNone(_compile_prefilter([]))
+
+    def test_no_literal_disables_prefilter(self):
+        self.assertIsNone(_compile_prefilter([re.compile('mutation'), re.compile(r'\d+[a-z]')]))
+        self.assertIsNone(_compile_prefilter([re.compile('(mut|)')]))
+
+
+class TestKeywordsDocumentFilter(unittest.TestCase):
+    def test_filter(self):
+        documents = [('1', _document('A Deletion.')), ('2', _document('Nothing.')),
+                     ('3', _document('Nothing.', 'A mutation.')), ('4', _document('An insertion.'))]
+        kept = [pmid for pmid, _ in KeywordsDocumentFilter().filter(documents)]
+        self.assertEqual(['1', '3', '4'], kept)
+
+
+class TestHighRecallRegexDocumentFilter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump([r'\bdeletion\b'], f)
+        cls.pattern_file_name = f.name
+        cls.filter = HighRecallRegexDocumentFilter(pattern_file_name=cls.pattern_file_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.pattern_file_name)
+
+    def kept(self, doc, min_found):
+        return [pmid for pmid, _ in self.filter.filter([('1', doc)], min_found=min_found)]
+
+    def test_positive_sentence_counted_once(self):
+        doc = _document('A deletion was found. Nothing else was found.')
+        self.assertEqual(['1'], self.kept(doc, min_found=1))
+        self.assertEqual([], self.kept(doc, min_found=2))
+
+    def test_positive_sentences(self):
+        doc = _document('A deletion was found. Nothing else was found.', 'Another deletion was found.')
+        self.assertEqual(['1'], self.kept(doc, min_found=2))
+        self.assertEqual([], self.kept(doc, min_found=3))
+
+    def test_no_patterns(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump([], f)
+        try:
+            doc = _document('A deletion was found.')
+            no_patterns = HighRecallRegexDocumentFilter(pattern_file_name=f.name)
+            self.assertEqual([], list(no_patterns.filter([('1', doc)])))
+        finally:
+            os.remove(f.name)
+
+
+class TestHighRecallRegexClassifier(unittest.TestCase):
+    def test_st_patterns_kept_with_nl(self):
+        with open(pkg_resources.resource_filename('nala.data', 'regex_st.json')) as f:
+            st_regexs = json.load(f)
+        classifier = HighRecallRegexClassifier(ST=True, NL=True)
+        regexs = [p.pattern for p in classifier.patterns]
+        for regex in st_regexs:
+            self.assertIn(regex, regexs)
+        self.assertEqual(len(set(regexs)), len(regexs))
+
+
+if __name__ == '__main__':
+    unittest.main()
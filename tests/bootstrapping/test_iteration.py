@@ -1,9 +1,14 @@
 import configparser
-from unittest import TestCase
-from nala.bootstrapping.iteration import Iteration
+import csv
+import tempfile
+from unittest import TestCase, mock
+from itertools import product
+from nala.bootstrapping.iteration import Iteration, _html_document_ids, _match_entities
 from nose.plugins.attrib import attr
 import os
 from nalaf.utils.writers import TagTogFormat
+from nalaf.utils.readers import HTMLReader
+from nalaf.structures.data import Entity
 import argparse
 
 
@@ -47,3 +52,107 @@ class TestIteration(TestCase):
         # print(iteration.reviewed)
         # GNormPlusGeneTagger().tag(iteration.reviewed, uniprot=True)
         # TagTogFormat(iteration.reviewed, to_save_to='flowers').export(0.8)
+
+
+class TestCrossValidation(TestCase):
+    def test_sum_of_folds(self):
+        # rows of tp, fp, fn, fp_overlap, fn_overlap, precision, recall, f1-score
+        exact = [2, 1, 1, 0, 0, 0.5, 0.5, 0.5]
+        overlapping = [3, 0, 0, 1, 1, 1.0, 1.0, 1.0]
+
+        with tempfile.TemporaryDirectory() as folder:
+            os.mkdir(os.path.join(folder, 'iteration_0'))
+            iteration = Iteration.__new__(Iteration)
+            iteration.bootstrapping_folder = folder
+            iteration.number = 1
+            iteration.threshold_val = 0.9
+            iteration.stats_file = os.path.join(folder, 'stats.csv')
+            iteration.read_cross_validation_data = mock.Mock()
+            iteration.read_cross_validation_data.return_value.cv_split.return_value = [None, None]
+            iteration._cross_validation_fold = \
+                lambda folds, evaluators, fold: (({1: exact}, exact), ({1: overlapping}, overlapping))
+
+            with mock.patch('nala.bootstrapping.iteration.MentionLevelEvaluator') as evaluator:
+                evaluator.return_value.calc_measures.side_effect = lambda *counts: list(counts)
+                iteration.cross_validation(2)
+
+            with open(os.path.join(folder, 'iteration_0', 'cross_validation.csv')) as f:
+                rows = {tuple(row[:3]): row[3:] for row in csv.reader(f)}
+            with open(iteration.stats_file) as f:
+                stats_rows = list(csv.reader(f))
+
+        self.assertEqual(['4', '2', '2', '0', '0'], rows[('sum_of_folds', 'exact', 'total')])
+        self.assertEqual(['6', '0', '0', '2', '2'], rows[('sum_of_folds', 'overlapping', 'total')])
+        self.assertEqual(['6', '0', '0', '2', '2'], rows[('sum_of_folds', 'overlapping', '1')])
+        self.assertEqual([['0', '1', '0.9', '6', '0', '0', '2', '2'], ['0', 'total', '0.9', '6', '0', '0', '2', '2']],
+                         stats_rows)
+
+
+class TestCleanReviewedFiles(TestCase):
+    def test_clean_reviewed_files(self):
+        with tempfile.TemporaryDirectory() as folder:
+            iteration = Iteration.__new__(Iteration)
+            iteration.candidates_folder = os.path.join(folder, 'candidates')
+            iteration.reviewed_folder = os.path.join(folder, 'reviewed')
+            outside = os.path.join(folder, 'outside')
+            for path in (os.path.join(iteration.candidates_folder, 'html'),
+                         os.path.join(iteration.reviewed_folder, 'sub'), outside):
+                os.makedirs(path)
+
+            files = {name: os.path.join(folder, name) for name in (
+                'candidates/html/abc-123.plain.html', 'reviewed/x-123.ann.json', 'reviewed/x-456.ann.json',
+                'reviewed/sub/y-456.ann.json', 'reviewed/noid.txt', 'outside/keepme-999.ann.json')}
+            for path in files.values():
+                open(path, 'w').close()
+            link = os.path.join(iteration.reviewed_folder, 'linkdir')
+            os.symlink(outside, link)
+
+            iteration.clean_reviewed_files()
+
+            self.assertTrue(os.path.exists(files['reviewed/x-123.ann.json']))
+            self.assertFalse(os.path.exists(files['reviewed/x-456.ann.json']))
+            self.assertFalse(os.path.exists(files['reviewed/sub/y-456.ann.json']))
+            self.assertFalse(os.path.exists(files['reviewed/noid.txt']))
+            # symbolic links to folders are not followed
+            self.assertTrue(os.path.islink(link))
+            self.assertTrue(os.path.exists(files['outside/keepme-999.ann.json']))
+
+
+class TestHtmlDocumentIds(TestCase):
+    def test_html_document_ids(self):
+        with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryDirectory() as linked:
+            os.makedirs(os.path.join(folder, 'sub', 'nested'))
+            os.symlink(linked, os.path.join(folder, 'sub', 'link'))
+            for name in ('abc-123.plain.html', '456.html', 'x-789.xml', 'no_dash.plain.html', 'notes.txt', '.hidden-1.html',
+                         'sub/a-b-321.plain.html', 'sub/nested/654.xml', 'sub/link/l-987.html'):
+                with open(os.path.join(folder, name), 'w') as f:
+                    f.write('<html><body></body></html>')
+
+            expected = set(HTMLReader(folder).read().documents.keys())
+            self.assertEqual({'123', '456', '789', 'no_dash', '321', '654', '987'}, expected)
+            self.assertEqual(expected, _html_document_ids(folder))
+
+
+class TestMatchEntities(TestCase):
+    def test_match_entities(self):
+        def entity(offset, text, class_id='e_2'):
+            return Entity(class_id=class_id, offset=offset, text=text)
+
+        annotations = [entity(0, 'A123T'), entity(28, 'deletion of exon'),  # spans the boundary at 32
+                       entity(40, ''), entity(70, 'R142X'), entity(96, ''),  # zero-length, at the boundary at 96
+                       entity(100, 'G-->A', 'e_1'), entity(130, 'Q3X')]
+        predictions = [entity(2, '23T'), entity(31, 'xon'), entity(38, 'rs1'), entity(40, ''),
+                       entity(63, 'abcdefgh'), entity(75, 'X'), entity(90, 'abcdefgh'),
+                       entity(100, 'G-->A'), entity(150, 'Q3X')]
+
+        self.addCleanup(setattr, Entity, 'equality_operator', Entity.equality_operator)
+        Entity.equality_operator = 'exact_or_overlapping'
+        expected = [(ann, pred) for ann, pred in product(annotations, predictions) if ann == pred]
+
+        matched, not_found_ann, not_found_pred = _match_entities(annotations, predictions)
+        self.assertEqual([(id(ann), id(pred)) for ann, pred in expected], [(id(ann), id(pred)) for ann, pred in matched])
+        self.assertEqual([id(ann) for ann in annotations if not any(ann is x for x, _ in expected)],
+                         [id(ann) for ann in not_found_ann])
+        self.assertEqual([id(pred) for pred in predictions if not any(pred is x for _, x in expected)],
+                         [id(pred) for pred in not_found_pred])
+